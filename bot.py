@@ -5,6 +5,20 @@ import re # For email validation
 from dotenv import load_dotenv
 import time # For token expiry
 import json # For API payloads
+import gzip # For the compressed onboarding record archive
+import csv # For onboarding record exports
+import sys
+import argparse
+from datetime import datetime
+import io
+import shutil
+import functools
+import threading
+import contextvars
+import collections
+import types
+import signal
+from contextlib import contextmanager, asynccontextmanager
 
 # Attempt to import aiohttp, guide user if not found
 try:
@@ -44,6 +58,33 @@ ADOBE_SIGN_API_BASE_PATH = "/api/rest/v6" # Common for v6 API
 ICA_TEMPLATE_PATH = os.getenv('ICA_TEMPLATE_PATH', 'IndependentContractorAgreement_Template.pdf') # Path to your PDF template
 ICA_TEMPLATE_FILENAME = os.path.basename(ICA_TEMPLATE_PATH) if ICA_TEMPLATE_PATH else "IndependentContractorAgreement_Template.pdf"
 
+# --- Adobe Sign Circuit Breaker Configuration ---
+ADOBE_CB_FAILURE_THRESHOLD = int(os.getenv('ADOBE_CB_FAILURE_THRESHOLD', '3')) # Consecutive failed/slow calls before the circuit opens
+ADOBE_CB_SLOW_CALL_SECONDS = float(os.getenv('ADOBE_CB_SLOW_CALL_SECONDS', '10')) # Calls slower than this count as failures
+ADOBE_CB_CALL_TIMEOUT_SECONDS = float(os.getenv('ADOBE_CB_CALL_TIMEOUT_SECONDS', '30')) # Hard limit for a single Adobe call
+ADOBE_CB_RESET_TIMEOUT_SECONDS = float(os.getenv('ADOBE_CB_RESET_TIMEOUT_SECONDS', '60')) # How long the circuit stays open before a health probe
+ADOBE_CB_PROBE_INTERVAL_SECONDS = float(os.getenv('ADOBE_CB_PROBE_INTERVAL_SECONDS', '15')) # How often the background worker checks the circuit/queue
+ADOBE_DEFERRED_QUEUE_PATH = os.getenv('ADOBE_DEFERRED_QUEUE_PATH', 'adobe_deferred_contracts.json') # Durable queue of contract requests made during outages
+ADOBE_DEFERRED_MAX_ATTEMPTS = int(os.getenv('ADOBE_DEFERRED_MAX_ATTEMPTS', '5')) # Give up on a queued request after this many failed attempts
+
+# --- Onboarding Record Archive Configuration ---
+ONBOARDING_ARCHIVE_DIR = os.getenv('ONBOARDING_ARCHIVE_DIR', 'onboarding_archive') # Completed/terminated sessions are appended here as gzipped JSONL
+ONBOARDING_ARCHIVE_MAX_BYTES = int(os.getenv('ONBOARDING_ARCHIVE_MAX_BYTES', str(5 * 1024 * 1024))) # Rotate the active archive file past this size
+ONBOARDING_ARCHIVE_ACTIVE_FILENAME = 'onboarding_records.jsonl.gz'
+ONBOARDING_ARCHIVE_FLUSH_RECORDS = int(os.getenv('ONBOARDING_ARCHIVE_FLUSH_RECORDS', '100')) # Write buffered records as one gzip member once this many are waiting...
+ONBOARDING_ARCHIVE_FLUSH_SECONDS = float(os.getenv('ONBOARDING_ARCHIVE_FLUSH_SECONDS', '300')) # ...or once the oldest has waited this long
+
+# --- Instrumentation / Profiling Configuration ---
+SLOW_HANDLER_THRESHOLD_MS = float(os.getenv('SLOW_HANDLER_THRESHOLD_MS', '500')) # Log handlers slower than this with their sub-spans
+PROFILER_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILER_SAMPLE_INTERVAL_MS', '5')) # Stack sampling interval for the staff `profile` command
+PROFILER_MAX_SECONDS = int(os.getenv('PROFILER_MAX_SECONDS', '120'))
+
+# --- Session Persistence / Catch-up Configuration ---
+ONBOARDING_SESSIONS_PATH = os.getenv('ONBOARDING_SESSIONS_PATH', 'onboarding_sessions.json') # Active sessions survive restarts so missed DMs can be replayed
+SESSION_SAVE_DEBOUNCE_SECONDS = float(os.getenv('SESSION_SAVE_DEBOUNCE_SECONDS', '2'))
+CATCHUP_CONCURRENCY = int(os.getenv('CATCHUP_CONCURRENCY', '5')) # DM channels fetched in parallel during catch-up
+PROCESSED_MESSAGE_ID_CACHE_SIZE = 10000
+
 # --- Bot Setup ---
 intents = discord.Intents.default()
 intents.messages = True
@@ -58,12 +99,45 @@ user_onboarding_states = {}
 _ADOBE_ACCESS_TOKEN = None
 _ADOBE_TOKEN_EXPIRES_AT = 0
 
+# --- Adobe Sign Circuit Breaker / Deferred Queue State ---
+_ADOBE_CIRCUIT_STATE = 'closed' # 'closed', 'open' or 'half_open'
+_ADOBE_CIRCUIT_FAILURES = 0
+_ADOBE_CIRCUIT_OPENED_AT = 0
+_ADOBE_DEFERRED_CONTRACTS = [] # Mirrors ADOBE_DEFERRED_QUEUE_PATH on disk
+_ADOBE_DEFERRED_DRAIN_LOCK = asyncio.Lock()
+_ADOBE_DEFERRED_WORKER_TASK = None
+
+# --- Onboarding Record Archive State ---
+_ONBOARDING_ARCHIVE_QUEUE = asyncio.Queue() # Records waiting for the background archive writer
+_ONBOARDING_ARCHIVE_BUFFER = [] # Records the writer has taken off the queue but not yet written as a gzip member
+_PENDING_ARCHIVE_RECORDS = {} # record key -> record not yet on disk; saved in the session snapshot so a crash can't lose it
+_ONBOARDING_ARCHIVE_WRITER_TASK = None
+
+# --- Instrumentation State ---
+_CURRENT_SPAN = contextvars.ContextVar('current_span', default=None)
+_SPAN_STATS = {} # span name -> {'count', 'total_ms', 'max_ms'}, since startup
+_PROFILER_TASK = None
+
+# --- Session Persistence / Catch-up State ---
+_SESSIONS_DIRTY = False
+_SESSION_SAVER_TASK = None
+_SESSIONS_SAVE_LOCK = asyncio.Lock() # Keeps the debounced saver and immediate flushes from racing on the same file
+_PROCESSED_MESSAGE_IDS = collections.OrderedDict() # Recently handled DM IDs, so replays and live events never double-process
+_USER_LOCKS = {} # user_id -> asyncio.Lock; serializes live and replayed DMs per user
+_CATCHUP_WATERMARKS = {} # user_id -> last_message_id when the bot last stopped/disconnected; history after it hasn't been replayed yet
+_CATCHUP_LOCK = asyncio.Lock()
+_CATCHUP_TASK = None
+
+# --- Discord UI Component State ---
+_ONBOARDING_VIEWS = {} # step awaiting input -> persistent View; built and registered in on_ready
+
 ONBOARDING_STEPS = [
     'start', 'collect_first_name', 'collect_last_name', 'check_computer_response',
     'ask_bilingual', 'check_bilingual_response', 'ask_languages', 'ask_state',
     'ask_email', # Data collection ends, then contract
     'final_instructions_pre_contract',      # Sends DECLARATION
     'awaiting_sign_contract_command',       # Waits for 'sign contract'
+    'awaiting_deferred_adobe_contract',     # Adobe Sign is down; request queued, link will be DM'd when it recovers
     'awaiting_adobe_signature_completion',  # Waits for 'contract signed' after URL is sent
     # Post-contract steps, triggered by 'contract signed' command
     'ask_add_friends',                      # New: Ask to add friends (formerly step 5)
@@ -75,6 +149,140 @@ ONBOARDING_STEPS = [
     'completed'
 ]
 
+US_STATE_NAMES = [
+    'Alabama', 'Alaska', 'Arizona', 'Arkansas', 'California', 'Colorado', 'Connecticut', 'Delaware',
+    'Florida', 'Georgia', 'Hawaii', 'Idaho', 'Illinois', 'Indiana', 'Iowa', 'Kansas', 'Kentucky',
+    'Louisiana', 'Maine', 'Maryland', 'Massachusetts', 'Michigan', 'Minnesota', 'Mississippi', 'Missouri',
+    'Montana', 'Nebraska', 'Nevada', 'New Hampshire', 'New Jersey', 'New Mexico', 'New York',
+    'North Carolina', 'North Dakota', 'Ohio', 'Oklahoma', 'Oregon', 'Pennsylvania', 'Rhode Island',
+    'South Carolina', 'South Dakota', 'Tennessee', 'Texas', 'Utah', 'Vermont', 'Virginia', 'Washington',
+    'West Virginia', 'Wisconsin', 'Wyoming'
+]
+# Lower-cased state names/abbreviations we cannot onboard from
+RESTRICTED_STATE_INPUTS = frozenset({'oregon', 'or', 'washington', 'wa', 'california', 'ca'})
+
+# Handling a reply in these steps talks to Adobe Sign or notifies staff, so the session is saved
+# right after instead of waiting for the debounced saver (a replay would repeat the side effect)
+ONBOARDING_SIDE_EFFECT_STEPS = frozenset({
+    'awaiting_sign_contract_command', 'awaiting_adobe_signature_completion', 'confirm_training_completion'
+})
+
+def set_onboarding_step(user_id, step):
+    """Moves a session to a new step and records when it got there (used for funnel timings in the archive)."""
+    state = user_onboarding_states[user_id]
+    state['step'] = step
+    state.setdefault('step_timings', {})[step] = time.time()
+
+# --- Instrumentation ---
+
+@contextmanager
+def timed_span(name, log_slow=True):
+    """
+    Times a block with time.perf_counter() and nests it under the enclosing span of the current task.
+    Root spans slower than SLOW_HANDLER_THRESHOLD_MS are logged together with their sub-spans, unless log_slow is False
+    (the span then only feeds the `timings` stats).
+    """
+    parent = _CURRENT_SPAN.get()
+    span = {'name': name, 'attrs': {}, 'children': [], 'closed': False}
+    token = _CURRENT_SPAN.set(span)
+    started_at = time.perf_counter()
+    try:
+        yield span
+    finally:
+        duration_ms = (time.perf_counter() - started_at) * 1000
+        span['duration_ms'] = duration_ms
+        span['closed'] = True
+        _CURRENT_SPAN.reset(token)
+
+        stats = _SPAN_STATS.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['count'] += 1
+        stats['total_ms'] += duration_ms
+        stats['max_ms'] = max(stats['max_ms'], duration_ms)
+
+        # Tasks spawned from a handler inherit its span; once that handler has finished, treat their spans as roots
+        if parent is not None and not parent['closed']:
+            parent['children'].append(span)
+        elif log_slow and duration_ms >= SLOW_HANDLER_THRESHOLD_MS:
+            print(f"SLOW HANDLER: over {SLOW_HANDLER_THRESHOLD_MS:.0f}ms threshold\n{format_span_tree(span)}")
+
+def annotate_current_span(**attrs):
+    span = _CURRENT_SPAN.get()
+    if span is not None:
+        span['attrs'].update(attrs)
+
+def format_span_tree(span, depth=0):
+    attrs = " ".join(f"{key}={value}" for key, value in span['attrs'].items())
+    lines = [f"{'  ' * (depth + 1)}{span['name']}{' (' + attrs + ')' if attrs else ''}: {span['duration_ms']:.1f}ms"]
+    for child in span['children']:
+        lines.append(format_span_tree(child, depth + 1))
+    return "\n".join(lines)
+
+def instrumented(name=None):
+    """Decorator: runs an async function inside a timed_span."""
+    def decorator(func):
+        span_name = name or func.__name__
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with timed_span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def format_span_stats(limit=15):
+    if not _SPAN_STATS:
+        return "No handler timings recorded yet."
+    lines = ["Handler timings since startup (by total time):", "name | count | avg ms | max ms | total ms"]
+    for name, stats in sorted(_SPAN_STATS.items(), key=lambda item: item[1]['total_ms'], reverse=True)[:limit]:
+        lines.append(f"{name} | {stats['count']} | {stats['total_ms'] / stats['count']:.1f} | {stats['max_ms']:.1f} | {stats['total_ms']:.0f}")
+    return "\n".join(lines)
+
+def _sample_thread_stacks(target_thread_id, stop_event, interval_seconds, folded_counts):
+    # Runs in its own thread and periodically snapshots the event loop thread's Python stack
+    while not stop_event.wait(interval_seconds):
+        frame = sys._current_frames().get(target_thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        if stack:
+            folded_counts[";".join(reversed(stack))] += 1
+
+async def run_sampling_profiler(seconds):
+    """
+    Samples the event loop thread's stack for `seconds` without blocking the loop.
+    Returns the samples in collapsed-stack format ("frame;frame;frame count"), ready for flamegraph.pl or speedscope.
+    """
+    folded_counts = collections.Counter()
+    stop_event = threading.Event()
+    sampler = threading.Thread(
+        target=_sample_thread_stacks,
+        args=(threading.get_ident(), stop_event, PROFILER_SAMPLE_INTERVAL_MS / 1000, folded_counts),
+        daemon=True
+    )
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop_event.set()
+        await asyncio.to_thread(sampler.join)
+    return "\n".join(f"{stack} {count}" for stack, count in folded_counts.most_common())
+
+async def run_profile_command(channel, seconds):
+    try:
+        print(f"INFO: Sampling profiler started for {seconds}s.")
+        folded = await run_sampling_profiler(seconds)
+        sample_count = sum(int(line.rsplit(' ', 1)[1]) for line in folded.splitlines())
+        filename = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+        await channel.send(
+            f"Profiling finished: {sample_count} samples over {seconds}s. "
+            "Collapsed stacks attached (use flamegraph.pl or https://www.speedscope.app).",
+            file=discord.File(io.BytesIO(folded.encode('utf-8')), filename=filename)
+        )
+        print(f"INFO: Sampling profiler finished ({sample_count} samples).")
+    except Exception as e:
+        print(f"ERROR: Sampling profiler failed: {e}")
+        await channel.send(f"Profiling failed: {e}")
+
 # --- Adobe Sign API Helper Functions (Stubs - Implement with actual API calls) ---
 
 async def get_adobe_access_token():
@@ -261,7 +469,488 @@ async def get_adobe_signing_url_for_signer(access_token, agreement_id, expected_
     return f"https://mock.adobesign.com/public/apiesign?pid=mock_pid_for_{expected_signer_email.replace('@','_at_')}"
     # --- END MOCK ---
 
+async def probe_adobe_health():
+    """
+    Lightweight Adobe Sign health check used while the circuit breaker is open.
+    Hits the baseUris endpoint, which requires a valid token but does no real work.
+    """
+    access_token = await get_adobe_access_token()
+    base_uris_endpoint = f"https://{ADOBE_SIGN_API_HOST}{ADOBE_SIGN_API_BASE_PATH}/baseUris"
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    print("DEBUG: Probing Adobe Sign health.")
+    # async with aiohttp.ClientSession() as session:
+    #     try:
+    #         async with session.get(base_uris_endpoint, headers=headers) as resp:
+    #             if resp.status == 200:
+    #                 return True
+    #             else:
+    #                 error_text = await resp.text()
+    #                 raise Exception(f"Adobe Health Probe Error: {resp.status} - {error_text}")
+    #     except aiohttp.ClientConnectorError as e:
+    #         raise Exception(f"Adobe Health Probe Connection Error: {e}")
+
+    # --- MOCK IMPLEMENTATION ---
+    print("MOCK: Simulating Adobe Sign health probe.")
+    if ADOBE_SIGN_API_HOST == "test_host_fail_probe":
+        raise Exception("Mock Adobe Health Probe Error: Simulated outage.")
+    return True
+    # --- END MOCK ---
+
+# --- Adobe Sign Circuit Breaker ---
+
+class AdobeCircuitOpenError(Exception):
+    """Raised instead of calling Adobe Sign while the circuit breaker is open."""
+
+def adobe_circuit_allows_request():
+    """Returns True only while the circuit is closed; in half-open just the health probe may reach Adobe Sign."""
+    return _ADOBE_CIRCUIT_STATE == 'closed'
+
+def record_adobe_success():
+    global _ADOBE_CIRCUIT_STATE, _ADOBE_CIRCUIT_FAILURES
+    _ADOBE_CIRCUIT_FAILURES = 0
+    if _ADOBE_CIRCUIT_STATE != 'closed':
+        _ADOBE_CIRCUIT_STATE = 'closed'
+        print("INFO: Adobe Sign circuit breaker closed. Adobe Sign calls resumed.")
+
+def record_adobe_failure(reason):
+    global _ADOBE_CIRCUIT_STATE, _ADOBE_CIRCUIT_FAILURES, _ADOBE_CIRCUIT_OPENED_AT
+    _ADOBE_CIRCUIT_FAILURES += 1
+    print(f"WARNING: Adobe Sign call failed ({_ADOBE_CIRCUIT_FAILURES}/{ADOBE_CB_FAILURE_THRESHOLD}): {reason}")
+    if _ADOBE_CIRCUIT_STATE == 'half_open' or _ADOBE_CIRCUIT_FAILURES >= ADOBE_CB_FAILURE_THRESHOLD:
+        if _ADOBE_CIRCUIT_STATE != 'open':
+            print(f"WARNING: Adobe Sign circuit breaker OPEN. Failing fast for {ADOBE_CB_RESET_TIMEOUT_SECONDS}s before probing again.")
+        _ADOBE_CIRCUIT_STATE = 'open'
+        _ADOBE_CIRCUIT_OPENED_AT = time.time()
+
+async def call_adobe_with_circuit_breaker(adobe_call, *args, is_probe=False):
+    """
+    Runs one Adobe Sign helper through the circuit breaker.
+    Fails fast with AdobeCircuitOpenError unless the circuit is closed (or this is the half-open probe),
+    enforces a hard timeout, and counts errors and slow calls towards opening the circuit.
+    """
+    probe_allowed = is_probe and _ADOBE_CIRCUIT_STATE == 'half_open'
+    if not (adobe_circuit_allows_request() or probe_allowed):
+        raise AdobeCircuitOpenError("Adobe Sign is temporarily unavailable (circuit open).")
+
+    started_at = time.monotonic()
+    try:
+        with timed_span(f"adobe:{adobe_call.__name__}"):
+            result = await asyncio.wait_for(adobe_call(*args), timeout=ADOBE_CB_CALL_TIMEOUT_SECONDS)
+    except (FileNotFoundError, ValueError):
+        raise # Local template/configuration problems, not an Adobe outage
+    except asyncio.TimeoutError:
+        record_adobe_failure(f"{adobe_call.__name__} timed out after {ADOBE_CB_CALL_TIMEOUT_SECONDS}s")
+        raise Exception(f"Adobe Sign did not respond within {ADOBE_CB_CALL_TIMEOUT_SECONDS}s")
+    except Exception as e:
+        record_adobe_failure(f"{adobe_call.__name__}: {e}")
+        raise
+
+    elapsed = time.monotonic() - started_at
+    if elapsed > ADOBE_CB_SLOW_CALL_SECONDS:
+        record_adobe_failure(f"{adobe_call.__name__} took {elapsed:.1f}s (slow call threshold {ADOBE_CB_SLOW_CALL_SECONDS}s)")
+    else:
+        record_adobe_success()
+    return result
+
+async def prepare_adobe_contract(user_data):
+    """
+    Runs the full Adobe Sign flow (token, upload, agreement, signing URL) for one hire.
+    Returns (agreement_id, signing_url).
+    """
+    user_email = user_data.get('email', 'not_provided@example.com')
+    user_first_name = user_data.get('first_name', 'Valued')
+    user_last_name = user_data.get('last_name', 'Contractor')
+    agreement_name = f"Independent Contractor Agreement - {user_first_name} {user_last_name} - {time.strftime('%Y-%m-%d')}"
+
+    token = await call_adobe_with_circuit_breaker(get_adobe_access_token)
+    transient_id = await call_adobe_with_circuit_breaker(upload_transient_document, token, ICA_TEMPLATE_PATH, ICA_TEMPLATE_FILENAME)
+    agreement_id = await call_adobe_with_circuit_breaker(create_adobe_agreement, token, transient_id, agreement_name, user_email, user_first_name, user_last_name)
+    signing_url = await call_adobe_with_circuit_breaker(get_adobe_signing_url_for_signer, token, agreement_id, user_email)
+    return agreement_id, signing_url
+
+def format_signing_link_message(signing_url):
+    return (
+        "Your Independent Contractor Agreement is ready to be signed.\n\n"
+        "Please click the link below to review and sign the document through Adobe Sign:\n"
+        f"{signing_url}\n\n"
+        "Once you have completed the signing process, please return here and press **Contract Signed** below (or type `contract signed`)."
+    )
+
+# --- Adobe Sign Deferred Contract Queue ---
+
+def load_adobe_deferred_contracts():
+    global _ADOBE_DEFERRED_CONTRACTS
+    if not ADOBE_DEFERRED_QUEUE_PATH or not os.path.exists(ADOBE_DEFERRED_QUEUE_PATH):
+        return
+    try:
+        with open(ADOBE_DEFERRED_QUEUE_PATH, 'r', encoding='utf-8') as f:
+            _ADOBE_DEFERRED_CONTRACTS = json.load(f)
+        print(f"INFO: Loaded {len(_ADOBE_DEFERRED_CONTRACTS)} deferred Adobe Sign contract request(s) from {ADOBE_DEFERRED_QUEUE_PATH}.")
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"ERROR: Could not load deferred Adobe Sign queue from {ADOBE_DEFERRED_QUEUE_PATH}: {e}")
+
+def save_adobe_deferred_contracts():
+    # Write-then-rename so a crash mid-write never leaves a truncated queue behind
+    tmp_path = f"{ADOBE_DEFERRED_QUEUE_PATH}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(_ADOBE_DEFERRED_CONTRACTS, f)
+        os.replace(tmp_path, ADOBE_DEFERRED_QUEUE_PATH)
+    except OSError as e:
+        print(f"ERROR: Could not save deferred Adobe Sign queue to {ADOBE_DEFERRED_QUEUE_PATH}: {e}")
+
+def enqueue_deferred_contract(user_id, state):
+    if any(entry['user_id'] == user_id for entry in _ADOBE_DEFERRED_CONTRACTS):
+        return
+    _ADOBE_DEFERRED_CONTRACTS.append({
+        'user_id': user_id,
+        'dm_channel_id': state.get('dm_channel_id'),
+        'data': dict(state['data']),
+        'started_at': state.get('started_at'),
+        'queued_at': time.time(),
+        'attempts': 0
+    })
+    save_adobe_deferred_contracts()
+    print(f"INFO: Queued deferred Adobe Sign contract for user {user_id}. Queue length: {len(_ADOBE_DEFERRED_CONTRACTS)}.")
+
+def remove_deferred_contract(user_id):
+    remaining = [entry for entry in _ADOBE_DEFERRED_CONTRACTS if entry['user_id'] != user_id]
+    if len(remaining) != len(_ADOBE_DEFERRED_CONTRACTS):
+        _ADOBE_DEFERRED_CONTRACTS[:] = remaining
+        save_adobe_deferred_contracts()
+
+async def defer_adobe_contract(user_id, channel):
+    """Queues the hire's contract request durably and tells them the link will follow."""
+    enqueue_deferred_contract(user_id, user_onboarding_states[user_id])
+    set_onboarding_step(user_id, 'awaiting_deferred_adobe_contract')
+    await channel.send(
+        "Adobe Sign is having trouble right now, so I've queued your contract request. "
+        "You don't need to do anything - I'll DM you the signing link here as soon as Adobe Sign is back."
+    )
+
+async def deliver_deferred_contract(entry):
+    """
+    DMs the signing link for a queued request whose agreement has already been prepared.
+    Returns False if the DM could not be sent; the caller keeps the entry queued so the link is not lost.
+    """
+    user_id = entry['user_id']
+    state = user_onboarding_states.get(user_id)
+    if state is not None and state['step'] != 'awaiting_deferred_adobe_contract':
+        print(f"INFO: Skipping deferred Adobe Sign delivery for user {user_id}; session moved on to '{state['step']}'.")
+        return True
+
+    try:
+        user = await client.fetch_user(user_id)
+        await user.send(format_signing_link_message(entry['signing_url']), view=_ONBOARDING_VIEWS.get('awaiting_adobe_signature_completion'))
+    except Exception as e:
+        print(f"ERROR: Could not DM deferred Adobe Sign link to user {user_id}: {e}")
+        return False
+
+    if state is None:
+        # Session was lost while the request was queued; rebuild it from the queued snapshot
+        state = {'step': 'awaiting_deferred_adobe_contract', 'data': entry['data'], 'dm_channel_id': entry.get('dm_channel_id'), 'started_at': entry.get('started_at')}
+        user_onboarding_states[user_id] = state
+    state['data']['adobe_agreement_id'] = entry['agreement_id']
+    set_onboarding_step(user_id, 'awaiting_adobe_signature_completion')
+    await flush_onboarding_sessions()
+    print(f"Successfully delivered deferred Adobe Sign agreement {entry['agreement_id']} to user {user_id}.")
+    return True
+
+async def drain_adobe_deferred_contracts():
+    async with _ADOBE_DEFERRED_DRAIN_LOCK:
+        for entry in list(_ADOBE_DEFERRED_CONTRACTS):
+            if not adobe_circuit_allows_request():
+                break
+            if entry not in _ADOBE_DEFERRED_CONTRACTS:
+                continue # User reset while an earlier entry was in flight
+            user_id = entry['user_id']
+
+            if not entry.get('signing_url'):
+                try:
+                    agreement_id, signing_url = await prepare_adobe_contract(entry['data'])
+                except AdobeCircuitOpenError:
+                    break
+                except Exception as e:
+                    if entry not in _ADOBE_DEFERRED_CONTRACTS:
+                        continue # User reset while the request was in flight
+                    entry['attempts'] = entry.get('attempts', 0) + 1
+                    print(f"ERROR: Deferred Adobe Sign contract for user {user_id} failed (attempt {entry['attempts']}): {e}")
+                    if not isinstance(e, (FileNotFoundError, ValueError)) and entry['attempts'] < ADOBE_DEFERRED_MAX_ATTEMPTS:
+                        save_adobe_deferred_contracts()
+                        break # Leave it queued and retry on the next worker tick
+                    _ADOBE_DEFERRED_CONTRACTS.remove(entry)
+                    save_adobe_deferred_contracts()
+                    if user_id in user_onboarding_states and user_onboarding_states[user_id]['step'] == 'awaiting_deferred_adobe_contract':
+                        set_onboarding_step(user_id, 'awaiting_sign_contract_command')
+                        mark_onboarding_sessions_dirty()
+                    try:
+                        user = await client.fetch_user(user_id)
+                        await user.send("I'm sorry, I still couldn't prepare your contract with Adobe Sign. Please type `sign contract` to try again later or contact an administrator.")
+                    except Exception as notify_error:
+                        print(f"ERROR: Could not notify user {user_id} about failed deferred contract: {notify_error}")
+                    continue
+
+                if entry not in _ADOBE_DEFERRED_CONTRACTS:
+                    continue # User reset while the request was in flight
+                # Keep the prepared agreement with the entry so a failed DM is retried without creating a second agreement
+                entry['agreement_id'] = agreement_id
+                entry['signing_url'] = signing_url
+                save_adobe_deferred_contracts()
+
+            if await deliver_deferred_contract(entry):
+                _ADOBE_DEFERRED_CONTRACTS.remove(entry)
+                save_adobe_deferred_contracts()
+                continue
+
+            entry['delivery_attempts'] = entry.get('delivery_attempts', 0) + 1
+            if entry['delivery_attempts'] < ADOBE_DEFERRED_MAX_ATTEMPTS:
+                save_adobe_deferred_contracts()
+                continue # Try the rest of the queue; this one is retried on the next worker tick
+            print(f"ERROR: Giving up on DMing user {user_id} their signing link after {entry['delivery_attempts']} attempts. "
+                  f"Agreement {entry['agreement_id']}, signing URL: {entry['signing_url']}")
+            _ADOBE_DEFERRED_CONTRACTS.remove(entry)
+            save_adobe_deferred_contracts()
+            if user_id in user_onboarding_states and user_onboarding_states[user_id]['step'] == 'awaiting_deferred_adobe_contract':
+                set_onboarding_step(user_id, 'awaiting_sign_contract_command')
+                mark_onboarding_sessions_dirty()
+
+async def probe_adobe_circuit():
+    global _ADOBE_CIRCUIT_STATE
+    _ADOBE_CIRCUIT_STATE = 'half_open'
+    print("INFO: Adobe Sign circuit breaker half-open. Probing Adobe Sign health...")
+    try:
+        await call_adobe_with_circuit_breaker(probe_adobe_health, is_probe=True)
+    except Exception as e:
+        print(f"WARNING: Adobe Sign health probe failed: {e}")
+        if _ADOBE_CIRCUIT_STATE == 'half_open':
+            record_adobe_failure(f"health probe: {e}")
+
+async def adobe_deferred_contract_worker():
+    """Background task: probes Adobe Sign while the circuit is open and drains the deferred queue once it is healthy."""
+    await client.wait_until_ready()
+    while not client.is_closed():
+        try:
+            if _ADOBE_CIRCUIT_STATE == 'open' and time.time() - _ADOBE_CIRCUIT_OPENED_AT >= ADOBE_CB_RESET_TIMEOUT_SECONDS:
+                await probe_adobe_circuit()
+            if _ADOBE_CIRCUIT_STATE == 'closed' and _ADOBE_DEFERRED_CONTRACTS:
+                await drain_adobe_deferred_contracts()
+        except Exception as e:
+            print(f"ERROR: Adobe Sign deferred contract worker: {e}")
+        await asyncio.sleep(ADOBE_CB_PROBE_INTERVAL_SECONDS)
+
+# --- Onboarding Record Archive ---
+
+ONBOARDING_ARCHIVE_FIELDS = [
+    'user_id', 'discord_name', 'outcome', 'final_step', 'first_name', 'last_name',
+    'has_computer', 'bilingual', 'languages', 'state', 'email', 'adobe_agreement_id',
+    'added_friends', 'training_completed', 'started_at', 'ended_at', 'duration_seconds', 'step_timings'
+]
+
+def archive_onboarding_session(user_id, outcome, discord_name=None):
+    """
+    Snapshots a finished session ('completed' or 'terminated_*') and hands it to the background archive writer.
+    Must be called before the session is removed from user_onboarding_states.
+    """
+    state = user_onboarding_states.get(user_id)
+    if state is None:
+        return
+    data = state['data']
+    started_at = state.get('started_at')
+    ended_at = time.time()
+    record = {
+        'user_id': user_id,
+        'discord_name': discord_name,
+        'outcome': outcome,
+        'final_step': state['step'],
+        'first_name': data.get('first_name'),
+        'last_name': data.get('last_name'),
+        'has_computer': data.get('has_computer'),
+        'bilingual': data.get('bilingual'),
+        'languages': data.get('languages'),
+        'state': data.get('state'),
+        'email': data.get('email'),
+        'adobe_agreement_id': data.get('adobe_agreement_id'),
+        'added_friends': data.get('added_friends'),
+        'training_completed': data.get('training_completed', False),
+        'started_at': started_at,
+        'ended_at': ended_at,
+        'duration_seconds': round(ended_at - started_at, 3) if started_at else None,
+        # Seconds from session start until each step was reached
+        'step_timings': {step: round(reached_at - started_at, 3) for step, reached_at in state.get('step_timings', {}).items()} if started_at else {}
+    }
+    queue_onboarding_archive_record(record)
+
+def _archive_record_key(record):
+    return f"{record['user_id']}:{record['ended_at']}"
+
+def queue_onboarding_archive_record(record):
+    # The record stays in _PENDING_ARCHIVE_RECORDS (and so in every session snapshot) until it is written,
+    # which means the session is never dropped from persisted state before its record is safe on disk
+    _PENDING_ARCHIVE_RECORDS[_archive_record_key(record)] = record
+    _ONBOARDING_ARCHIVE_QUEUE.put_nowait(record)
+
+def list_onboarding_archive_files(archive_dir):
+    """Archive files oldest first: rotated files (timestamped names sort chronologically), then the active file."""
+    if not os.path.isdir(archive_dir):
+        return []
+    rotated = sorted(
+        name for name in os.listdir(archive_dir)
+        if name.startswith('onboarding_records-') and name.endswith('.jsonl.gz')
+    )
+    files = [os.path.join(archive_dir, name) for name in rotated]
+    active_path = os.path.join(archive_dir, ONBOARDING_ARCHIVE_ACTIVE_FILENAME)
+    if os.path.exists(active_path):
+        files.append(active_path)
+    return files
+
+def recompress_onboarding_archive_file(path):
+    # Folds the many appended gzip members of a rotated file into one, so it compresses as a whole.
+    # Written to a temp file first: if this is interrupted, the original multi-member file is still valid.
+    tmp_path = f"{path}.tmp"
+    with gzip.open(path, 'rb') as src, gzip.open(tmp_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp_path, path)
+
+def write_onboarding_archive_records(records):
+    # Runs in a worker thread. Each append adds a new gzip member, which gzip readers concatenate transparently;
+    # the writer buffers records so members stay large, and rotated files are recompressed into a single member.
+    os.makedirs(ONBOARDING_ARCHIVE_DIR, exist_ok=True)
+    active_path = os.path.join(ONBOARDING_ARCHIVE_DIR, ONBOARDING_ARCHIVE_ACTIVE_FILENAME)
+    if os.path.exists(active_path) and os.path.getsize(active_path) >= ONBOARDING_ARCHIVE_MAX_BYTES:
+        rotated_path = os.path.join(ONBOARDING_ARCHIVE_DIR, f"onboarding_records-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.jsonl.gz")
+        os.replace(active_path, rotated_path)
+        try:
+            recompress_onboarding_archive_file(rotated_path)
+        except OSError as e:
+            print(f"WARNING: Could not recompress rotated onboarding archive {rotated_path}; keeping it as is: {e}")
+        print(f"INFO: Rotated onboarding archive to {rotated_path}.")
+    with gzip.open(active_path, 'at', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+def mark_archive_records_written(records):
+    for record in records:
+        _PENDING_ARCHIVE_RECORDS.pop(_archive_record_key(record), None)
+    mark_onboarding_sessions_dirty() # Next snapshot no longer needs to carry them
+
+async def onboarding_archive_writer():
+    """
+    Background task: buffers queued session records and appends them to the archive off the event loop,
+    one gzip member per ONBOARDING_ARCHIVE_FLUSH_RECORDS records or ONBOARDING_ARCHIVE_FLUSH_SECONDS, whichever comes first.
+    Buffered records are still in _PENDING_ARCHIVE_RECORDS, so they survive a crash via the session snapshot.
+    """
+    flush_deadline = None
+    while True:
+        timeout = None if flush_deadline is None else max(0, flush_deadline - time.monotonic())
+        try:
+            _ONBOARDING_ARCHIVE_BUFFER.append(await asyncio.wait_for(_ONBOARDING_ARCHIVE_QUEUE.get(), timeout))
+            while not _ONBOARDING_ARCHIVE_QUEUE.empty():
+                _ONBOARDING_ARCHIVE_BUFFER.append(_ONBOARDING_ARCHIVE_QUEUE.get_nowait())
+        except asyncio.TimeoutError:
+            pass
+        if flush_deadline is None:
+            flush_deadline = time.monotonic() + ONBOARDING_ARCHIVE_FLUSH_SECONDS
+        if len(_ONBOARDING_ARCHIVE_BUFFER) < ONBOARDING_ARCHIVE_FLUSH_RECORDS and time.monotonic() < flush_deadline:
+            continue
+
+        records = list(_ONBOARDING_ARCHIVE_BUFFER)
+        while True:
+            try:
+                await asyncio.to_thread(write_onboarding_archive_records, records)
+                break
+            except Exception as e:
+                print(f"ERROR: Failed to archive {len(records)} onboarding record(s), retrying in 5s: {e}")
+                await asyncio.sleep(5)
+        del _ONBOARDING_ARCHIVE_BUFFER[:len(records)]
+        mark_archive_records_written(records)
+        flush_deadline = None
+        print(f"DEBUG: Archived {len(records)} onboarding record(s).")
+
+def drain_onboarding_archive_queue_on_shutdown():
+    """Writes buffered records and any the background writer never picked up. Runs after the event loop has stopped."""
+    records = list(_ONBOARDING_ARCHIVE_BUFFER)
+    _ONBOARDING_ARCHIVE_BUFFER.clear()
+    while not _ONBOARDING_ARCHIVE_QUEUE.empty():
+        records.append(_ONBOARDING_ARCHIVE_QUEUE.get_nowait())
+    if not records:
+        return
+    try:
+        write_onboarding_archive_records(records)
+        mark_archive_records_written(records)
+        print(f"INFO: Archived {len(records)} pending onboarding record(s) on shutdown.")
+    except Exception as e:
+        print(f"ERROR: Could not archive {len(records)} onboarding record(s) on shutdown; they stay in the session snapshot: {e}")
+
+def iter_onboarding_archive_records(archive_dir, since=None, until=None, outcomes=None):
+    """
+    Streams archived records one line at a time, oldest first.
+    since/until are epoch seconds compared against 'ended_at'; outcomes matches exactly or by prefix
+    (e.g. 'terminated' matches 'terminated_restricted_state').
+    """
+    for path in list_onboarding_archive_files(archive_dir):
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    ended_at = record.get('ended_at') or 0
+                    if since is not None and ended_at < since:
+                        continue
+                    if until is not None and ended_at >= until:
+                        continue
+                    if outcomes and not any(record.get('outcome') == o or record.get('outcome', '').startswith(o + '_') for o in outcomes):
+                        continue
+                    yield record
+        except (EOFError, OSError, json.JSONDecodeError) as e:
+            # A crash mid-append can leave a truncated final gzip member; keep what was readable
+            print(f"WARNING: Stopped reading {path} early: {e}", file=sys.stderr)
+
+def export_onboarding_records(output, export_format, records):
+    count = 0
+    if export_format == 'csv':
+        writer = csv.DictWriter(output, fieldnames=ONBOARDING_ARCHIVE_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for record in records:
+            row = dict(record)
+            row['step_timings'] = json.dumps(record.get('step_timings', {}))
+            writer.writerow(row)
+            count += 1
+    else:
+        for record in records:
+            output.write(json.dumps(record) + "\n")
+            count += 1
+    return count
+
+def run_export_cli(argv):
+    """Entry point for `python bot.py export ...`."""
+    parser = argparse.ArgumentParser(prog='bot.py export', description='Stream archived onboarding records as CSV or JSONL.')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    parser.add_argument('--since', help='Only records that ended on or after this date (YYYY-MM-DD).')
+    parser.add_argument('--until', help='Only records that ended on or before this date (YYYY-MM-DD).')
+    parser.add_argument('--outcome', action='append', help="Filter by outcome, e.g. 'completed' or 'terminated'. Repeatable.")
+    parser.add_argument('--archive-dir', default=ONBOARDING_ARCHIVE_DIR)
+    parser.add_argument('--output', help='Output file (defaults to stdout).')
+    args = parser.parse_args(argv)
+
+    try:
+        since = datetime.strptime(args.since, '%Y-%m-%d').timestamp() if args.since else None
+        until = datetime.strptime(args.until, '%Y-%m-%d').timestamp() + 86400 if args.until else None # Inclusive of the whole day
+    except ValueError as e:
+        parser.error(f"Invalid date: {e}")
+
+    records = iter_onboarding_archive_records(args.archive_dir, since=since, until=until, outcomes=args.outcome)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            count = export_onboarding_records(f, args.format, records)
+    else:
+        count = export_onboarding_records(sys.stdout, args.format, records)
+    print(f"Exported {count} onboarding record(s).", file=sys.stderr)
+    return 0
+
 # --- Onboarding Logic ---
+@instrumented()
 async def send_onboarding_message(user_id, step_name_override=None):
     if user_id not in user_onboarding_states:
         print(f"User {user_id} not in onboarding states. Cannot send message.")
@@ -269,10 +958,12 @@ async def send_onboarding_message(user_id, step_name_override=None):
 
     state = user_onboarding_states[user_id]
     current_step_name = step_name_override if step_name_override else state['step']
+    annotate_current_span(step=current_step_name)
     
     user = None
     try:
-        user = await client.fetch_user(user_id)
+        with timed_span('discord:fetch_user'):
+            user = await client.fetch_user(user_id)
     except discord.NotFound:
         print(f"Error: Could not fetch user {user_id} (User not found). Removing from onboarding.")
         if user_id in user_onboarding_states: del user_onboarding_states[user_id]
@@ -332,7 +1023,7 @@ async def send_onboarding_message(user_id, step_name_override=None):
     elif current_step_name == 'final_instructions_pre_contract':
         message_content = (
             "DECLARATION. I hereby declare that the information I am providing in the Adobe eSign documents is true to the best of my knowledge and belief and nothing has been concealed therein. I understand that if the information provided by me is proved false/not true, I will have to face the punishment as per the law.\n\n"
-            "To proceed with your Independent Contractor Agreement using Adobe Sign, please type `sign contract` back to me."
+            "To proceed with your Independent Contractor Agreement using Adobe Sign, please press **Sign Contract** below or type `sign contract` back to me."
         )
         next_step_in_flow = 'awaiting_sign_contract_command'
 
@@ -364,7 +1055,7 @@ async def send_onboarding_message(user_id, step_name_override=None):
             f"   - Read the Training Manual: {TRAINING_MANUAL_URL}\n"
             f"   - Watch the Training Video: {TRAINING_VIDEO_URL}\n"
             f"   - Listen to Training Recordings: {TRAINING_RECORDINGS_URL}\n\n"
-            "Once you have completed ALL of these, please reply with 'DONE'."
+            "Once you have completed ALL of these, please press **DONE** below or reply with 'DONE'."
         )
         next_step_in_flow = 'confirm_training_completion'
 
@@ -441,7 +1132,7 @@ async def send_onboarding_message(user_id, step_name_override=None):
             print(f"Note: Issues notifying staff for user {user.name}: {', '.join(failed_to_notify_descriptors)}")
 
         # Update state and trigger the next message sending (final welcome)
-        user_onboarding_states[user_id]['step'] = 'final_welcome_and_discord_link'
+        set_onboarding_step(user_id, 'final_welcome_and_discord_link')
         await send_onboarding_message(user_id, step_name_override='final_welcome_and_discord_link')
         return # Crucial: prevent this block from trying to send its own message_content as it's handled by recursive call
     
@@ -459,23 +1150,333 @@ async def send_onboarding_message(user_id, step_name_override=None):
 
     if message_content: 
         try:
-            await user.send(message_content)
+            with timed_span('discord:send_dm'):
+                # Steps that wait for a fixed answer get buttons/a select menu; typed replies still work
+                await user.send(message_content, view=_ONBOARDING_VIEWS.get(next_step_in_flow))
             if next_step_in_flow:
-                 user_onboarding_states[user_id]['step'] = next_step_in_flow
+                 set_onboarding_step(user_id, next_step_in_flow)
                  print(f"User {user.name} advanced to step: {next_step_in_flow}")
             
             # Check if new state is 'completed' and clean up
             # Need to check if user_id still exists in states, as a recursive call might have already deleted it
             if user_id in user_onboarding_states and user_onboarding_states[user_id]['step'] == 'completed':
                 print(f"Onboarding fully completed for user {user.name}. Removing from active states.")
+                archive_onboarding_session(user_id, 'completed', user.name)
                 del user_onboarding_states[user_id]
         except discord.Forbidden:
             print(f"Could not send DM to {user.name} ({user_id}). DMs disabled or bot blocked.")
         except Exception as e:
             print(f"Error sending DM to {user.name}: {e}")
 
+# --- Session Persistence ---
+
+def load_onboarding_sessions():
+    if not ONBOARDING_SESSIONS_PATH or not os.path.exists(ONBOARDING_SESSIONS_PATH):
+        return
+    try:
+        with open(ONBOARDING_SESSIONS_PATH, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        saved_sessions = snapshot.get('sessions', {})
+        for user_id_str, state in saved_sessions.items():
+            user_id = int(user_id_str) # JSON object keys are strings
+            user_onboarding_states.setdefault(user_id, state)
+            if state.get('last_message_id'):
+                _CATCHUP_WATERMARKS[user_id] = state['last_message_id']
+        # Finished sessions whose archive record hadn't been written yet when the bot stopped
+        pending_records = snapshot.get('pending_archive_records', [])
+        for record in pending_records:
+            queue_onboarding_archive_record(record)
+        print(f"INFO: Restored {len(saved_sessions)} active onboarding session(s) and {len(pending_records)} pending archive record(s) from {ONBOARDING_SESSIONS_PATH}.")
+    except (OSError, ValueError) as e:
+        print(f"ERROR: Could not load onboarding sessions from {ONBOARDING_SESSIONS_PATH}: {e}")
+
+def serialize_onboarding_snapshot():
+    # Serialize on the loop thread so the dicts can't change mid-dump
+    return json.dumps({
+        'sessions': user_onboarding_states,
+        'pending_archive_records': list(_PENDING_ARCHIVE_RECORDS.values())
+    })
+
+def write_onboarding_sessions_file(serialized_sessions):
+    # Write-then-rename so a crash mid-write never leaves a truncated snapshot behind
+    tmp_path = f"{ONBOARDING_SESSIONS_PATH}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(serialized_sessions)
+    os.replace(tmp_path, ONBOARDING_SESSIONS_PATH)
+
+def mark_onboarding_sessions_dirty():
+    global _SESSIONS_DIRTY
+    _SESSIONS_DIRTY = True
+
+async def flush_onboarding_sessions():
+    """Writes the session snapshot now rather than waiting for the debounced saver."""
+    global _SESSIONS_DIRTY
+    async with _SESSIONS_SAVE_LOCK:
+        _SESSIONS_DIRTY = False
+        try:
+            await asyncio.to_thread(write_onboarding_sessions_file, serialize_onboarding_snapshot())
+        except Exception as e:
+            _SESSIONS_DIRTY = True
+            print(f"ERROR: Could not save onboarding sessions to {ONBOARDING_SESSIONS_PATH}: {e}")
+
+async def onboarding_session_saver():
+    """Background task: snapshots user_onboarding_states to disk at most once per SESSION_SAVE_DEBOUNCE_SECONDS."""
+    while True:
+        await asyncio.sleep(SESSION_SAVE_DEBOUNCE_SECONDS)
+        if _SESSIONS_DIRTY:
+            await flush_onboarding_sessions()
+
+def flush_state_on_shutdown():
+    """Runs after client.run() returns, once the event loop is gone: persists whatever the background tasks hadn't written yet."""
+    drain_onboarding_archive_queue_on_shutdown()
+    if _SESSIONS_DIRTY:
+        try:
+            write_onboarding_sessions_file(serialize_onboarding_snapshot())
+            print(f"INFO: Saved {len(user_onboarding_states)} active onboarding session(s) on shutdown.")
+        except Exception as e:
+            print(f"ERROR: Could not save onboarding sessions on shutdown: {e}")
+
+# --- DM Processing & Missed Message Catch-up ---
+
+def _get_user_lock(user_id):
+    lock = _USER_LOCKS.get(user_id)
+    if lock is None:
+        lock = _USER_LOCKS[user_id] = asyncio.Lock()
+    return lock
+
+@asynccontextmanager
+async def _user_lock_span(user_id, span_name):
+    """
+    Holds the user's lock for a handler. The wait for the lock is timed as its own stats-only span,
+    so the handler span (and the slow-handler log) covers only the work done once the lock is held.
+    """
+    lock = _get_user_lock(user_id)
+    with timed_span(f"{span_name}:lock_wait", log_slow=False):
+        await lock.acquire()
+    try:
+        with timed_span(span_name):
+            yield
+    finally:
+        lock.release()
+
+def _remember_processed_message(message_id):
+    _PROCESSED_MESSAGE_IDS[message_id] = True
+    if len(_PROCESSED_MESSAGE_IDS) > PROCESSED_MESSAGE_ID_CACHE_SIZE:
+        _PROCESSED_MESSAGE_IDS.popitem(last=False)
+
+async def _process_dm_message_locked(message):
+    """
+    Handles one DM. Caller must hold the author's user lock.
+    Delivery is at-least-once across restarts: a DM handled after the last saved snapshot is replayed by catch-up,
+    which is why steps with side effects are saved immediately.
+    """
+    if message.id in _PROCESSED_MESSAGE_IDS:
+        return False
+    _remember_processed_message(message.id)
+    user_id = message.author.id
+    step_before = user_onboarding_states.get(user_id, {}).get('step')
+    try:
+        await handle_dm_message(message)
+    finally:
+        state = user_onboarding_states.get(user_id)
+        if state is not None:
+            state['last_message_id'] = max(state.get('last_message_id') or 0, message.id)
+        if step_before in ONBOARDING_SIDE_EFFECT_STEPS:
+            await flush_onboarding_sessions()
+        else:
+            mark_onboarding_sessions_dirty()
+    return True
+
+async def get_session_dm_channel(user_id, state):
+    channel = client.get_channel(state.get('dm_channel_id')) if state.get('dm_channel_id') else None
+    if channel is None:
+        user = await client.fetch_user(user_id)
+        channel = user.dm_channel or await user.create_dm()
+        state['dm_channel_id'] = channel.id
+    return channel
+
+async def _catch_up_user_locked(user_id):
+    """
+    Replays the user's DMs after their catch-up watermark, oldest first. Caller must hold the user's lock.
+    Runs before any live input from that user is handled, so a live DM can never overtake a missed one.
+    The watermark is only cleared once the replay succeeds; exceptions propagate to the caller.
+    """
+    watermark = _CATCHUP_WATERMARKS.get(user_id)
+    if watermark is None:
+        return 0
+    state = user_onboarding_states.get(user_id)
+    if state is None:
+        _CATCHUP_WATERMARKS.pop(user_id, None)
+        return 0
+    with timed_span('catchup'):
+        channel = await get_session_dm_channel(user_id, state)
+        missed_messages = [
+            missed async for missed in channel.history(limit=None, after=discord.Object(id=watermark), oldest_first=True)
+            if missed.author.id == user_id
+        ]
+        recovered = 0
+        for missed in missed_messages:
+            if await _process_dm_message_locked(missed):
+                recovered += 1
+        annotate_current_span(user_id=user_id, replayed=recovered)
+    _CATCHUP_WATERMARKS.pop(user_id, None)
+    return recovered
+
+async def process_dm_message(message):
+    if message.id in _PROCESSED_MESSAGE_IDS:
+        return False
+    user_id = message.author.id
+    async with _user_lock_span(user_id, 'on_message'):
+        try:
+            await _catch_up_user_locked(user_id)
+        except Exception as e:
+            # The live DM is still after the watermark, so the next catch-up attempt replays it in order
+            print(f"ERROR: Catch-up failed for user {user_id}; holding their DM {message.id} until it succeeds: {e}")
+            return False
+        return await _process_dm_message_locked(message)
+
+async def recover_missed_messages_for_user(user_id, semaphore):
+    async with semaphore:
+        async with _get_user_lock(user_id):
+            return await _catch_up_user_locked(user_id)
+
+async def recover_missed_messages(reason):
+    """
+    Replays DMs that arrived while the bot was disconnected or restarting, for every active session,
+    in order and through the normal handler. Runs at most one pass at a time.
+    """
+    if _CATCHUP_LOCK.locked():
+        return
+    async with _CATCHUP_LOCK:
+        started_at = time.perf_counter()
+        user_ids = list(_CATCHUP_WATERMARKS)
+        semaphore = asyncio.Semaphore(CATCHUP_CONCURRENCY)
+        results = await asyncio.gather(
+            *(recover_missed_messages_for_user(user_id, semaphore) for user_id in user_ids),
+            return_exceptions=True
+        )
+        recovered = 0
+        failed = 0
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"ERROR: Catch-up failed for user {user_id}: {result}")
+            else:
+                recovered += result
+        elapsed = time.perf_counter() - started_at
+        print(f"INFO: Catch-up after {reason}: recovered {recovered} missed DM(s) across {len(user_ids)} session(s) in {elapsed:.2f}s"
+              f"{f' ({failed} session(s) failed)' if failed else ''}.")
+
+# --- Discord UI Components ---
+
+class OnboardingComponentInput(types.SimpleNamespace):
+    """Stands in for a discord.Message so button/select input runs through the same handler as typed replies."""
+
+class OnboardingButton(discord.ui.Button):
+    def __init__(self, step, label, value, style):
+        # custom_id encodes the step and answer so the handler survives restarts once the view is re-registered
+        super().__init__(label=label, style=style, custom_id=f"onboarding:{step}:{value}")
+        self.step = step
+        self.value = value
+
+    async def callback(self, interaction):
+        await handle_onboarding_component(interaction, self.step, self.value)
+
+class OnboardingStateSelect(discord.ui.Select):
+    def __init__(self, part, state_names):
+        super().__init__(
+            placeholder=f"Select your state ({state_names[0]} - {state_names[-1]})",
+            options=[discord.SelectOption(label=state_name, value=state_name) for state_name in state_names],
+            custom_id=f"onboarding:ask_state:{part}"
+        )
+
+    async def callback(self, interaction):
+        await handle_onboarding_component(interaction, 'ask_state', self.values[0])
+
+class OnboardingView(discord.ui.View):
+    def __init__(self, items):
+        super().__init__(timeout=None) # Persistent: never expires, re-attached by custom_id after restarts
+        for item in items:
+            self.add_item(item)
+
+def build_onboarding_views():
+    """One persistent view per step that waits for a fixed answer, keyed by that step."""
+    def yes_no(step):
+        return OnboardingView([
+            OnboardingButton(step, 'Yes', 'Y', discord.ButtonStyle.success),
+            OnboardingButton(step, 'No', 'N', discord.ButtonStyle.danger)
+        ])
+    def single_action(step, label, value):
+        return OnboardingView([OnboardingButton(step, label, value, discord.ButtonStyle.primary)])
+
+    # Discord caps select menus at 25 options, so the 50 states are split across two menus
+    return {
+        'check_computer_response': yes_no('check_computer_response'),
+        'check_bilingual_response': yes_no('check_bilingual_response'),
+        'check_add_friends_response': yes_no('check_add_friends_response'),
+        'ask_state': OnboardingView([
+            OnboardingStateSelect(1, US_STATE_NAMES[:25]),
+            OnboardingStateSelect(2, US_STATE_NAMES[25:])
+        ]),
+        'awaiting_sign_contract_command': single_action('awaiting_sign_contract_command', 'Sign Contract', 'sign contract'),
+        'awaiting_adobe_signature_completion': single_action('awaiting_adobe_signature_completion', 'Contract Signed', 'contract signed'),
+        'confirm_training_completion': single_action('confirm_training_completion', 'DONE', 'DONE')
+    }
+
+async def handle_onboarding_component(interaction, expected_step, value):
+    user_id = interaction.user.id
+    # Acknowledge within Discord's ~3s window before waiting on the user lock, which an Adobe flow or catch-up can hold much longer
+    await interaction.response.defer()
+    async with _user_lock_span(user_id, 'on_component'):
+        try:
+            await _catch_up_user_locked(user_id) # Missed typed replies may have already answered this question
+        except Exception as e:
+            print(f"ERROR: Catch-up failed for user {user_id}; not applying their '{value}' selection yet: {e}")
+            await interaction.followup.send("Sorry, I couldn't process that right now. Please try again in a moment.")
+            return
+        state = user_onboarding_states.get(user_id)
+        if state is None or state['step'] != expected_step:
+            # Old buttons stay on earlier messages; don't let them answer whatever question is current now
+            await interaction.followup.send("That option is no longer active. Please follow my most recent message.")
+            return
+        await interaction.edit_original_response(view=None) # Remove the components so the choice can't be submitted twice
+        component_input = OnboardingComponentInput(
+            id=interaction.id, author=interaction.user, channel=interaction.channel, content=value
+        )
+        await _process_dm_message_locked(component_input)
+
+@client.event
+@instrumented()
+async def setup_hook():
+    """
+    Runs once, before the gateway connects. Saved state has to be loaded here: DMs can be dispatched
+    to on_message before on_ready fires, and they must find their restored session.
+    """
+    global _ADOBE_DEFERRED_WORKER_TASK, _ONBOARDING_ARCHIVE_WRITER_TASK, _SESSION_SAVER_TASK, _ONBOARDING_VIEWS
+    load_onboarding_sessions()
+    load_adobe_deferred_contracts()
+
+    _ONBOARDING_VIEWS = build_onboarding_views()
+    for view in _ONBOARDING_VIEWS.values():
+        client.add_view(view) # Buttons/menus on messages sent before a restart keep working
+    print(f"INFO: Registered {len(_ONBOARDING_VIEWS)} persistent onboarding views.")
+
+    _SESSION_SAVER_TASK = asyncio.create_task(onboarding_session_saver())
+    _ONBOARDING_ARCHIVE_WRITER_TASK = asyncio.create_task(onboarding_archive_writer())
+    _ADOBE_DEFERRED_WORKER_TASK = asyncio.create_task(adobe_deferred_contract_worker())
+    print(f"INFO: Completed/terminated onboarding sessions will be archived to: {ONBOARDING_ARCHIVE_DIR}")
+    print(f"INFO: Adobe Sign circuit breaker active (threshold: {ADOBE_CB_FAILURE_THRESHOLD} failures, slow call: {ADOBE_CB_SLOW_CALL_SECONDS}s, timeout: {ADOBE_CB_CALL_TIMEOUT_SECONDS}s).")
+
+    try:
+        # Let `docker stop`/systemd shut down through client.close() so state is flushed after client.run() returns
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(client.close()))
+    except (NotImplementedError, RuntimeError):
+        pass # Signal handlers are unavailable on Windows event loops
+
 @client.event
+@instrumented()
 async def on_ready():
+    global _CATCHUP_TASK
     print(f'Logged in as {client.user.name} ({client.user.id})')
     print('------')
     
@@ -505,242 +1506,284 @@ async def on_ready():
         print("ERROR: Adobe Sign is not fully configured. Contract signing via Adobe Sign will likely fail.")
     print('------')
 
+    # Sessions were restored in setup_hook. This covers both a fresh start and a reconnect that needed a new gateway session
+    _CATCHUP_TASK = asyncio.create_task(recover_missed_messages('startup/reconnect'))
+
+@client.event
+@instrumented()
+async def on_disconnect():
+    # DMs sent from here on may never reach on_message; replay each session's history from this point once back
+    for user_id, state in list(user_onboarding_states.items()):
+        if state.get('last_message_id'):
+            _CATCHUP_WATERMARKS.setdefault(user_id, state['last_message_id'])
+
+@client.event
+@instrumented()
+async def on_resumed():
+    global _CATCHUP_TASK
+    _CATCHUP_TASK = asyncio.create_task(recover_missed_messages('resume'))
+
 @client.event
 async def on_message(message):
     if message.author == client.user:
         return
 
     if isinstance(message.channel, discord.DMChannel):
-        user_id = message.author.id
-        processed_message_content = message.content.lower().strip()
-
-        if processed_message_content == 'start':
-            if user_id in user_onboarding_states and user_onboarding_states[user_id].get('step') == 'completed':
-                del user_onboarding_states[user_id] 
-
-            if user_id not in user_onboarding_states:
-                print(f"Starting onboarding for user {message.author.name} ({user_id}) via 'start' command")
-                user_onboarding_states[user_id] = {
-                    'step': 'start', 'data': {}, 'dm_channel_id': message.channel.id
-                }
-                await send_onboarding_message(user_id)
+        await process_dm_message(message)
+
+async def handle_dm_message(message):
+    global _PROFILER_TASK
+    user_id = message.author.id
+    processed_message_content = message.content.lower().strip()
+
+    # --- Staff-only diagnostics ---
+    if user_id in (CEO_USER_ID, DEV_USER_ID):
+        profile_match = re.fullmatch(r'profile(?:\s+(\d+))?', processed_message_content)
+        if profile_match:
+            seconds = max(1, min(int(profile_match.group(1) or 10), PROFILER_MAX_SECONDS))
+            if _PROFILER_TASK is not None and not _PROFILER_TASK.done():
+                await message.channel.send("A profiling session is already running. Please wait for it to finish.")
             else:
-                await message.channel.send("You are already in the onboarding process. Reply to my last question or type `reset` to start over.")
+                await message.channel.send(f"Sampling the bot for {seconds} seconds. I'll send the dump when it's done.")
+                _PROFILER_TASK = asyncio.create_task(run_profile_command(message.channel, seconds)) # Don't hold this handler open for the whole run
             return
-
-        if processed_message_content == 'reset':
-            if user_id in user_onboarding_states:
-                del user_onboarding_states[user_id]
-                await message.channel.send("Your onboarding state has been reset. Type `start` to begin again.")
-            else:
-                await message.channel.send("You are not currently in an onboarding process to reset.")
-            return
-
-        if processed_message_content == 'complete': # Largely deprecated command
-            if user_id in user_onboarding_states:
-                current_user_step = user_onboarding_states[user_id]['step']
-                await message.channel.send(f"The `complete` command is not needed at this stage ('{current_user_step}'). Please follow the current instructions or reply to my last question.")
-            else:
-                await message.channel.send("You are not currently in an onboarding stage where the `complete` command is applicable.")
+        if processed_message_content == 'timings':
+            await message.channel.send(f"```\n{format_span_stats()}\n```")
             return
 
-        if processed_message_content == 'sign contract':
-            if user_id in user_onboarding_states and user_onboarding_states[user_id]['step'] == 'awaiting_sign_contract_command':
+    if processed_message_content == 'start':
+        if user_id in user_onboarding_states and user_onboarding_states[user_id].get('step') == 'completed':
+            del user_onboarding_states[user_id] 
 
-                await message.channel.send("Thank you. I will now prepare your Independent Contractor Agreement using Adobe Sign. This may take a moment...")
-                
-                user_data = user_onboarding_states[user_id]['data']
-                user_email = user_data.get('email', 'not_provided@example.com')
-                user_first_name = user_data.get('first_name', 'Valued')
-                user_last_name = user_data.get('last_name', 'Contractor')
-                agreement_name = f"Independent Contractor Agreement - {user_first_name} {user_last_name} - {time.strftime('%Y-%m-%d')}"
+        if user_id not in user_onboarding_states:
+            print(f"Starting onboarding for user {message.author.name} ({user_id}) via 'start' command")
+            user_onboarding_states[user_id] = {
+                'step': 'start', 'data': {}, 'dm_channel_id': message.channel.id,
+                'started_at': time.time(), 'step_timings': {}
+            }
+            await send_onboarding_message(user_id)
+        else:
+            await message.channel.send("You are already in the onboarding process. Reply to my last question or type `reset` to start over.")
+        return
 
-                try:
-                    token = await get_adobe_access_token()
-                    transient_id = await upload_transient_document(token, ICA_TEMPLATE_PATH, ICA_TEMPLATE_FILENAME)
-                    agreement_id = await create_adobe_agreement(token, transient_id, agreement_name, user_email, user_first_name, user_last_name)
-                    signing_url = await get_adobe_signing_url_for_signer(token, agreement_id, user_email)
-
-                    user_onboarding_states[user_id]['data']['adobe_agreement_id'] = agreement_id
-
-                    await message.channel.send(
-                        "Your Independent Contractor Agreement is ready to be signed.\n\n"
-                        "Please click the link below to review and sign the document through Adobe Sign:\n"
-                        f"{signing_url}\n\n"
-                        "Once you have completed the signing process, please return here and type `contract signed`."
-                    )
-                    user_onboarding_states[user_id]['step'] = 'awaiting_adobe_signature_completion'
-                    print(f"Successfully initiated Adobe Sign agreement {agreement_id} for {user_email}. Signing URL sent.")
-
-                except FileNotFoundError as e:
-                    await message.channel.send("I'm sorry, I couldn't find the contract template file. Please notify an administrator.")
-                    print(f"ERROR: Adobe Sign ICA template file error: {e}")
-                except Exception as e:
-                    await message.channel.send(f"I encountered an error while trying to prepare your contract with Adobe Sign: {e}. Please try again later or contact an administrator.")
-                    print(f"ERROR: Adobe Sign API process failed for user {message.author.name}: {e}")
+    if processed_message_content == 'reset':
+        if user_id in user_onboarding_states:
+            del user_onboarding_states[user_id]
+            remove_deferred_contract(user_id)
+            await message.channel.send("Your onboarding state has been reset. Type `start` to begin again.")
+        else:
+            await message.channel.send("You are not currently in an onboarding process to reset.")
+        return
 
-            elif user_id in user_onboarding_states and user_onboarding_states[user_id]['step'] == 'awaiting_adobe_signature_completion':
-                await message.channel.send("I've already sent you the link to sign the contract. Please use that link and then type `contract signed` once you're done.")
-            else:
-                await message.channel.send("You can use `sign contract` after you've acknowledged the declaration message.")
-            return
+    if processed_message_content == 'complete': # Largely deprecated command
+        if user_id in user_onboarding_states:
+            current_user_step = user_onboarding_states[user_id]['step']
+            await message.channel.send(f"The `complete` command is not needed at this stage ('{current_user_step}'). Please follow the current instructions or reply to my last question.")
+        else:
+            await message.channel.send("You are not currently in an onboarding stage where the `complete` command is applicable.")
+        return
 
-        if processed_message_content == 'contract signed':
-            if user_id in user_onboarding_states and user_onboarding_states[user_id]['step'] == 'awaiting_adobe_signature_completion':
-                user_onboarding_states[user_id]['data']['contract_process_completed_by_user'] = True
-                user_data = user_onboarding_states[user_id]['data']
-                user_email = user_data.get('email', 'N/A')
-                first_name = user_data.get('first_name', 'N/A')
-                last_name = user_data.get('last_name', 'N/A')
-                agreement_id = user_data.get('adobe_agreement_id', 'N/A')
-
-                await message.channel.send(
-                    "Thank you for confirming! Your Independent Contractor Agreement is now marked as signed on your end."
-                )
-                print(f"User {message.author.name} confirmed 'contract signed' for Adobe agreement ID: {agreement_id}.")
-
-                notification_message_for_staff = (
-                    f"ALERT: User {first_name} {last_name} (Discord: {message.author.name}, ID: {user_id}, Email: {user_email}) "
-                    f"has indicated they have SIGNED the Independent Contractor Agreement (Adobe Agreement ID: {agreement_id}) via Adobe Sign. "
-                    f"Please verify the document status in Adobe Sign."
-                )
-                if CEO_USER_ID:
-                    try:
-                        ceo_user = await client.fetch_user(CEO_USER_ID)
-                        if ceo_user: await ceo_user.send(notification_message_for_staff)
-                        print(f"Notified CEO about user confirmation for Adobe Sign agreement {agreement_id}.")
-                    except Exception as e: print(f"Failed to notify CEO (Adobe Sign confirm): {e}")
-                if DEV_USER_ID:
-                    try:
-                        dev_user = await client.fetch_user(DEV_USER_ID)
-                        if dev_user: await dev_user.send(notification_message_for_staff)
-                        print(f"Notified Dev about user confirmation for Adobe Sign agreement {agreement_id}.")
-                    except Exception as e: print(f"Failed to notify Dev (Adobe Sign confirm): {e}")
-                
-                await send_onboarding_message(user_id, step_name_override='ask_add_friends') # Start post-contract steps
-            else:
-                await message.channel.send("You can use `contract signed` after I've sent you a link to sign the document and you've completed it.")
-            return
+    if processed_message_content == 'sign contract':
+        if user_id in user_onboarding_states and user_onboarding_states[user_id]['step'] == 'awaiting_sign_contract_command':
+            if not adobe_circuit_allows_request():
+                # Adobe Sign is known to be down; don't make the hire wait out another failure
+                await defer_adobe_contract(user_id, message.channel)
+                return
 
-        if user_id not in user_onboarding_states:
-            await message.channel.send("Hello! To begin the onboarding process, please type `start`.")
-            return
+            await message.channel.send("Thank you. I will now prepare your Independent Contractor Agreement using Adobe Sign. This may take a moment...")
+            
+            user_data = user_onboarding_states[user_id]['data']
+            user_email = user_data.get('email', 'not_provided@example.com')
 
-        state = user_onboarding_states[user_id]
-        current_step = state['step']
-        response = message.content.strip()
+            try:
+                agreement_id, signing_url = await prepare_adobe_contract(user_data)
+
+                user_onboarding_states[user_id]['data']['adobe_agreement_id'] = agreement_id
+
+                await message.channel.send(format_signing_link_message(signing_url), view=_ONBOARDING_VIEWS.get('awaiting_adobe_signature_completion'))
+                set_onboarding_step(user_id, 'awaiting_adobe_signature_completion')
+                print(f"Successfully initiated Adobe Sign agreement {agreement_id} for {user_email}. Signing URL sent.")
+
+            except AdobeCircuitOpenError:
+                await defer_adobe_contract(user_id, message.channel)
+            except FileNotFoundError as e:
+                await message.channel.send("I'm sorry, I couldn't find the contract template file. Please notify an administrator.")
+                print(f"ERROR: Adobe Sign ICA template file error: {e}")
+            except ValueError as e:
+                await message.channel.send("I'm sorry, contract signing isn't set up correctly right now. Please notify an administrator.")
+                print(f"ERROR: Adobe Sign configuration error: {e}")
+            except Exception as e:
+                # Treat any other Adobe Sign failure as transient: queue it rather than asking the hire to retry by hand
+                print(f"ERROR: Adobe Sign API process failed for user {message.author.name}: {e}")
+                await defer_adobe_contract(user_id, message.channel)
+
+        elif user_id in user_onboarding_states and user_onboarding_states[user_id]['step'] == 'awaiting_deferred_adobe_contract':
+            await message.channel.send("Your contract request is already queued. I'll DM you the signing link as soon as Adobe Sign is available again.")
+        elif user_id in user_onboarding_states and user_onboarding_states[user_id]['step'] == 'awaiting_adobe_signature_completion':
+            await message.channel.send("I've already sent you the link to sign the contract. Please use that link and then type `contract signed` once you're done.")
+        else:
+            await message.channel.send("You can use `sign contract` after you've acknowledged the declaration message.")
+        return
 
-        if current_step == 'collect_first_name':
-            if response: 
-                state['data']['first_name'] = response
-                await send_onboarding_message(user_id, step_name_override='collect_first_name')
-            else:
-                await message.channel.send("Please provide your legal first name.")
-            return
-        
-        elif current_step == 'collect_last_name':
-            if response: 
-                state['data']['last_name'] = response
-                await send_onboarding_message(user_id, step_name_override='collect_last_name')
-            else:
-                await message.channel.send("Please provide your legal last name.")
-            return
+    if processed_message_content == 'contract signed':
+        if user_id in user_onboarding_states and user_onboarding_states[user_id]['step'] == 'awaiting_adobe_signature_completion':
+            user_onboarding_states[user_id]['data']['contract_process_completed_by_user'] = True
+            user_data = user_onboarding_states[user_id]['data']
+            user_email = user_data.get('email', 'N/A')
+            first_name = user_data.get('first_name', 'N/A')
+            last_name = user_data.get('last_name', 'N/A')
+            agreement_id = user_data.get('adobe_agreement_id', 'N/A')
+
+            await message.channel.send(
+                "Thank you for confirming! Your Independent Contractor Agreement is now marked as signed on your end."
+            )
+            print(f"User {message.author.name} confirmed 'contract signed' for Adobe agreement ID: {agreement_id}.")
+
+            notification_message_for_staff = (
+                f"ALERT: User {first_name} {last_name} (Discord: {message.author.name}, ID: {user_id}, Email: {user_email}) "
+                f"has indicated they have SIGNED the Independent Contractor Agreement (Adobe Agreement ID: {agreement_id}) via Adobe Sign. "
+                f"Please verify the document status in Adobe Sign."
+            )
+            if CEO_USER_ID:
+                try:
+                    ceo_user = await client.fetch_user(CEO_USER_ID)
+                    if ceo_user: await ceo_user.send(notification_message_for_staff)
+                    print(f"Notified CEO about user confirmation for Adobe Sign agreement {agreement_id}.")
+                except Exception as e: print(f"Failed to notify CEO (Adobe Sign confirm): {e}")
+            if DEV_USER_ID:
+                try:
+                    dev_user = await client.fetch_user(DEV_USER_ID)
+                    if dev_user: await dev_user.send(notification_message_for_staff)
+                    print(f"Notified Dev about user confirmation for Adobe Sign agreement {agreement_id}.")
+                except Exception as e: print(f"Failed to notify Dev (Adobe Sign confirm): {e}")
+            
+            await send_onboarding_message(user_id, step_name_override='ask_add_friends') # Start post-contract steps
+        else:
+            await message.channel.send("You can use `contract signed` after I've sent you a link to sign the document and you've completed it.")
+        return
 
-        elif current_step == 'check_computer_response':
-            if processed_message_content.upper() == 'Y':
-                state['data']['has_computer'] = True
-            elif processed_message_content.upper() == 'N':
-                state['data']['has_computer'] = False
-                await message.channel.send(
-                    "A computer or laptop (not an iPad or tablet) is required for this role. "
-                    "Unfortunately, we cannot proceed with your onboarding at this time. "
-                    "Please contact your hiring manager."
-                )
-                if user_id in user_onboarding_states: del user_onboarding_states[user_id]
-                print(f"Onboarding terminated for {message.author.name} (no computer).")
-                return 
-            else:
-                await message.channel.send("Invalid input. Please answer Y or N.")
-                return
-            await send_onboarding_message(user_id, step_name_override='ask_bilingual')
+    if user_id not in user_onboarding_states:
+        await message.channel.send("Hello! To begin the onboarding process, please type `start`.")
+        return
 
-        elif current_step == 'check_bilingual_response':
-            if processed_message_content.upper() == 'Y':
-                state['data']['bilingual'] = True
-            elif processed_message_content.upper() == 'N':
-                state['data']['bilingual'] = False
-            else:
-                await message.channel.send("Invalid input. Please answer Y or N.")
-                return
-            await send_onboarding_message(user_id, step_name_override='check_bilingual_response') 
+    state = user_onboarding_states[user_id]
+    current_step = state['step']
+    annotate_current_span(step=current_step)
+    response = message.content.strip()
+
+    if current_step == 'collect_first_name':
+        if response: 
+            state['data']['first_name'] = response
+            await send_onboarding_message(user_id, step_name_override='collect_first_name')
+        else:
+            await message.channel.send("Please provide your legal first name.")
+        return
+    
+    elif current_step == 'collect_last_name':
+        if response: 
+            state['data']['last_name'] = response
+            await send_onboarding_message(user_id, step_name_override='collect_last_name')
+        else:
+            await message.channel.send("Please provide your legal last name.")
+        return
 
-        elif current_step == 'ask_languages': 
-            state['data']['languages'] = response
-            await send_onboarding_message(user_id, step_name_override='ask_languages')
+    elif current_step == 'check_computer_response':
+        if processed_message_content.upper() == 'Y':
+            state['data']['has_computer'] = True
+        elif processed_message_content.upper() == 'N':
+            state['data']['has_computer'] = False
+            await message.channel.send(
+                "A computer or laptop (not an iPad or tablet) is required for this role. "
+                "Unfortunately, we cannot proceed with your onboarding at this time. "
+                "Please contact your hiring manager."
+            )
+            archive_onboarding_session(user_id, 'terminated_no_computer', message.author.name)
+            if user_id in user_onboarding_states: del user_onboarding_states[user_id]
+            print(f"Onboarding terminated for {message.author.name} (no computer).")
+            return 
+        else:
+            await message.channel.send("Invalid input. Please answer Y or N.")
             return
+        await send_onboarding_message(user_id, step_name_override='ask_bilingual')
 
-        elif current_step == 'ask_state': 
-            state['data']['state'] = response 
-            normalized_state_input = response.strip().lower()
-            restricted_states_map = {
-                'oregon': 'OR', 'or': 'OR',
-                'washington': 'WA', 'wa': 'WA',
-                'california': 'CA', 'ca': 'CA'
-            }
-            if normalized_state_input in restricted_states_map:
-                await message.channel.send(
-                    "Thank you for your interest. Unfortunately, we are unable to proceed with your application "
-                    "in Oregon, Washington, or California at this time."
-                )
-                if user_id in user_onboarding_states: del user_onboarding_states[user_id]
-                print(f"Onboarding terminated for {message.author.name} (restricted state).")
-                return
-            else:
-                await send_onboarding_message(user_id, step_name_override='ask_state') 
+    elif current_step == 'check_bilingual_response':
+        if processed_message_content.upper() == 'Y':
+            state['data']['bilingual'] = True
+        elif processed_message_content.upper() == 'N':
+            state['data']['bilingual'] = False
+        else:
+            await message.channel.send("Invalid input. Please answer Y or N.")
             return
+        await send_onboarding_message(user_id, step_name_override='check_bilingual_response') 
 
-        elif current_step == 'ask_email':
-            if re.match(r"[^@]+@[^@]+\.[^@]+", response):
-                state['data']['email'] = response
-                await send_onboarding_message(user_id, step_name_override='final_instructions_pre_contract') 
-            else:
-                await message.channel.send("That doesn't look like a valid email address. Please try again.")
-            return
-        
-        elif current_step == 'check_add_friends_response':
-            if processed_message_content.upper() == 'Y':
-                state['data']['added_friends'] = True
-            elif processed_message_content.upper() == 'N':
-                state['data']['added_friends'] = False
-                await message.channel.send(f"Please ensure you add the required contacts. This is important for team communication.")
-            else:
-                await message.channel.send("Invalid input. Please answer Y or N.")
-                return 
-            await send_onboarding_message(user_id, step_name_override='provide_training_materials')
-            return
+    elif current_step == 'ask_languages': 
+        state['data']['languages'] = response
+        await send_onboarding_message(user_id, step_name_override='ask_languages')
+        return
 
-        elif current_step == 'confirm_training_completion':
-            if processed_message_content.upper() == 'DONE':
-                state['data']['training_completed'] = True
-                # This will trigger notifications and then the final welcome message sequence in send_onboarding_message
-                await send_onboarding_message(user_id, step_name_override='confirm_training_completion') 
-            else:
-                await message.channel.send("Please type 'DONE' once you have completed all training materials.")
+    elif current_step == 'ask_state': 
+        state['data']['state'] = response 
+        normalized_state_input = response.strip().lower()
+        if normalized_state_input in RESTRICTED_STATE_INPUTS:
+            await message.channel.send(
+                "Thank you for your interest. Unfortunately, we are unable to proceed with your application "
+                "in Oregon, Washington, or California at this time."
+            )
+            archive_onboarding_session(user_id, 'terminated_restricted_state', message.author.name)
+            if user_id in user_onboarding_states: del user_onboarding_states[user_id]
+            print(f"Onboarding terminated for {message.author.name} (restricted state).")
             return
-        
-        elif current_step == 'awaiting_sign_contract_command':
-            await message.channel.send("Please type `sign contract` to proceed with the agreement, or `reset`.")
-            return
-        elif current_step == 'awaiting_adobe_signature_completion':
-            await message.channel.send("Please use the Adobe Sign link I provided. Once signed, type `contract signed` back here.")
-            return
-        elif current_step == 'completed':
-             await message.channel.send("Your onboarding is complete! Type `reset` then `start` to restart.")
-             return
+        else:
+            await send_onboarding_message(user_id, step_name_override='ask_state') 
+        return
+
+    elif current_step == 'ask_email':
+        if re.match(r"[^@]+@[^@]+\.[^@]+", response):
+            state['data']['email'] = response
+            await send_onboarding_message(user_id, step_name_override='final_instructions_pre_contract') 
+        else:
+            await message.channel.send("That doesn't look like a valid email address. Please try again.")
+        return
+    
+    elif current_step == 'check_add_friends_response':
+        if processed_message_content.upper() == 'Y':
+            state['data']['added_friends'] = True
+        elif processed_message_content.upper() == 'N':
+            state['data']['added_friends'] = False
+            await message.channel.send(f"Please ensure you add the required contacts. This is important for team communication.")
+        else:
+            await message.channel.send("Invalid input. Please answer Y or N.")
+            return 
+        await send_onboarding_message(user_id, step_name_override='provide_training_materials')
+        return
+
+    elif current_step == 'confirm_training_completion':
+        if processed_message_content.upper() == 'DONE':
+            state['data']['training_completed'] = True
+            # This will trigger notifications and then the final welcome message sequence in send_onboarding_message
+            await send_onboarding_message(user_id, step_name_override='confirm_training_completion') 
+        else:
+            await message.channel.send("Please type 'DONE' once you have completed all training materials.")
+        return
+    
+    elif current_step == 'awaiting_sign_contract_command':
+        await message.channel.send("Please type `sign contract` to proceed with the agreement, or `reset`.")
+        return
+    elif current_step == 'awaiting_deferred_adobe_contract':
+        await message.channel.send("Adobe Sign is temporarily unavailable. Your contract request is queued and I'll DM you the signing link soon.")
+        return
+    elif current_step == 'awaiting_adobe_signature_completion':
+        await message.channel.send("Please use the Adobe Sign link I provided. Once signed, type `contract signed` back here.")
+        return
+    elif current_step == 'completed':
+         await message.channel.send("Your onboarding is complete! Type `reset` then `start` to restart.")
+         return
 
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'export':
+        sys.exit(run_export_cli(sys.argv[2:]))
     if not BOT_TOKEN:
         print("ERROR: DISCORD_BOT_TOKEN environment variable not found.")
     else:
@@ -756,3 +1799,5 @@ if __name__ == "__main__":
                 print("ERROR: Privileged Intents Required. Enable 'SERVER MEMBERS INTENT' and 'MESSAGE CONTENT INTENT' in Discord Developer Portal.")
             except Exception as e:
                 print(f"An unexpected error occurred while trying to run the bot: {e}")
+            finally:
+                flush_state_on_shutdown()
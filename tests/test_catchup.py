@@ -0,0 +1,101 @@
+import asyncio
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("aiohttp")
+pytest.importorskip("dotenv")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import bot  # noqa: E402
+
+USER_ID = 42
+
+
+class FakeDMChannel:
+    def __init__(self, messages):
+        self.id = 7
+        self.messages = messages
+
+    async def history(self, limit=None, after=None, oldest_first=True):
+        for message in sorted(self.messages, key=lambda m: m.id):
+            if after is None or message.id > after.id:
+                yield message
+
+
+def make_message(message_id, content, channel):
+    return types.SimpleNamespace(id=message_id, content=content, channel=channel, author=types.SimpleNamespace(id=USER_ID))
+
+
+@pytest.fixture
+def restored_session(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, 'ONBOARDING_SESSIONS_PATH', str(tmp_path / 'sessions.json'))
+    monkeypatch.setattr(bot, 'user_onboarding_states', {})
+    monkeypatch.setattr(bot, '_CATCHUP_WATERMARKS', {})
+    monkeypatch.setattr(bot, '_USER_LOCKS', {})
+    monkeypatch.setattr(bot, '_PROCESSED_MESSAGE_IDS', bot.collections.OrderedDict())
+
+    (tmp_path / 'sessions.json').write_text(bot.json.dumps({
+        'sessions': {str(USER_ID): {'step': 'check_computer_response', 'data': {}, 'dm_channel_id': 7, 'last_message_id': 100}},
+        'pending_archive_records': []
+    }))
+    bot.load_onboarding_sessions()
+
+    handled = []
+
+    async def fake_handle_dm_message(message):
+        state = bot.user_onboarding_states[USER_ID]
+        handled.append((message.content, state['step']))
+        if state['step'] == 'check_computer_response' and message.content == 'Y':
+            state['step'] = 'check_bilingual_response'
+
+    monkeypatch.setattr(bot, 'handle_dm_message', fake_handle_dm_message)
+    return handled
+
+
+def test_live_dm_after_restart_waits_for_missed_dms(monkeypatch, restored_session):
+    channel = FakeDMChannel([])
+    missed = make_message(200, 'Y', channel)
+    live = make_message(300, 'hello?', channel)
+    channel.messages.extend([missed, live])
+
+    async def fake_get_session_dm_channel(user_id, state):
+        return channel
+
+    monkeypatch.setattr(bot, 'get_session_dm_channel', fake_get_session_dm_channel)
+
+    # The live DM is dispatched before the startup catch-up pass has run
+    asyncio.run(bot.process_dm_message(live))
+
+    assert restored_session == [('Y', 'check_computer_response'), ('hello?', 'check_bilingual_response')]
+    assert bot.user_onboarding_states[USER_ID]['step'] == 'check_bilingual_response'
+    assert bot.user_onboarding_states[USER_ID]['last_message_id'] == 300
+    assert USER_ID not in bot._CATCHUP_WATERMARKS
+
+    # A later catch-up pass finds nothing left to replay
+    asyncio.run(bot.recover_missed_messages('startup/reconnect'))
+    assert len(restored_session) == 2
+
+
+def test_live_dm_is_held_when_catch_up_fails(monkeypatch, restored_session):
+    channel = FakeDMChannel([])
+    live = make_message(300, 'hello?', channel)
+    channel.messages.append(live)
+
+    async def failing_get_session_dm_channel(user_id, state):
+        raise RuntimeError("Discord unavailable")
+
+    monkeypatch.setattr(bot, 'get_session_dm_channel', failing_get_session_dm_channel)
+    assert asyncio.run(bot.process_dm_message(live)) is False
+    assert restored_session == []
+    assert bot._CATCHUP_WATERMARKS[USER_ID] == 100
+
+    async def fake_get_session_dm_channel(user_id, state):
+        return channel
+
+    monkeypatch.setattr(bot, 'get_session_dm_channel', fake_get_session_dm_channel)
+    asyncio.run(bot.recover_missed_messages('resume'))
+    assert restored_session == [('hello?', 'check_computer_response')]